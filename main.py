@@ -1,14 +1,18 @@
 import os
 import sys
-import json
 import time
+import threading
 import logging
-from typing import Any, Dict, Tuple, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Tuple, Optional
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 import argparse
+import csv
+from concurrent.futures import Future
 from datetime import datetime, timezone
-import pandas as pd
+from functools import lru_cache
 
 # Initialize logging
 logging.basicConfig(
@@ -30,54 +34,112 @@ API_URL = 'https://api.catonetworks.com/api/v1/graphql2'
 MAX_RETRIES = 10
 RETRY_SLEEP = 2  # seconds
 RATE_LIMIT_SLEEP = 5  # seconds
+# Accept-Encoding is left to requests, which already advertises gzip and deflate
+# (plus br/zstd when those decoders are installed)
+DEFAULT_HEADERS = {
+    'Content-Type': 'application/json'
+}
+
+# Only the marker changes between pages, so the query is sent with variables
+AUDIT_FEED_QUERY = '''
+query auditFeed($accountIDs: [ID!], $timeFrame: TimeFrame!, $marker: String) {
+	auditFeed(accountIDs: $accountIDs, timeFrame: $timeFrame, marker: $marker) {
+		marker
+		fetchedCount
+		hasMore
+		accounts {
+			id
+			records {
+				time
+				fieldsMap
+			}
+		}
+	}
+}'''
+
+
+def create_session() -> requests.Session:
+    """
+    Create a requests Session that keeps the connection to the API alive between calls.
 
+    Returns:
+        requests.Session: A session with the default headers and a small connection pool mounted for HTTPS.
+    """
+    session = requests.Session()
+    session.headers.update(DEFAULT_HEADERS)
+    # Retries are handled by send_query, so the adapter itself never retries
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0)
+    session.mount('https://', adapter)
+    return session
+
+
+# Shared session so paginated calls reuse the same TCP+TLS connection
+SESSION = create_session()
 
-def send_query(query: str, api_key: str) -> Tuple[bool, Optional[Dict[str, Any]]]:
+
+def send_query(payload: bytes, session: requests.Session = SESSION) -> Tuple[bool, Optional[Dict[str, Any]]]:
     """
     Send a GraphQL query to the Cato Networks API.
 
     Args:
-        query (str): The GraphQL query string.
-        api_key (str): The API key for authentication.
+        payload (bytes): The JSON request body holding the query and its variables.
+        session (requests.Session, optional): The session to send the request with. Its headers
+            must already carry the API key. Defaults to the shared SESSION.
 
     Returns:
         Tuple[bool, Optional[Dict[str, Any]]]: A tuple where the first element is a success flag,
         and the second element is the JSON response or error details.
     """
     retry_count = 0
-    headers = {
-        'x-api-key': api_key,
-        'Content-Type': 'application/json'
-    }
-    data = {'query': query}
 
     while retry_count <= MAX_RETRIES:
         try:
-            logger.debug("Sending POST request to %s with query: %s", API_URL, query)
-            response = requests.post(API_URL, headers=headers, json=data, timeout=30)
+            logger.debug("Sending POST request to %s with payload: %s", API_URL, payload)
+            response = session.post(API_URL, data=payload, timeout=30)
+
+            # Handle rate limiting reported through the HTTP status
+            if response.status_code == 429:
+                logger.warning("Rate limit encountered. Sleeping for %s seconds.", RATE_LIMIT_SLEEP)
+                time.sleep(RATE_LIMIT_SLEEP)
+                retry_count += 1
+                continue
+
             response.raise_for_status()
-            result = response.json()
-
-            # Handle rate limiting
-            if 'errors' in result:
-                error_messages = [error.get('message', '') for error in result['errors']]
-                logger.error("API returned errors: %s", result['errors'])
-
-                if any('rate limit' in msg.lower() for msg in error_messages):
-                    logger.warning("Rate limit encountered. Sleeping for %s seconds.", RATE_LIMIT_SLEEP)
-                    time.sleep(RATE_LIMIT_SLEEP)
-                    retry_count += 1
-                    continue
-                elif any('timeFrame' in error.get('path', []) for error in result['errors']):
-                    logger.error("Error related to 'timeFrame'. Please verify the parameter value.")
-                    return False, result
-                else:
-                    logger.error("Unhandled API errors: %s", error_messages)
-                    return False, result
-
-            return True, result
-
-        except requests.exceptions.RequestException as e:
+            # Parse the raw bytes in one pass instead of response.json(), which decodes the
+            # body to str first; the records are mutated later, so a lazy read-only
+            # document would have to be materialized anyway
+            result = orjson.loads(response.content)
+
+            # Fast path: most pages carry no errors at all
+            errors = result.get('errors')
+            if errors is None:
+                return True, result
+
+            logger.error("API returned errors: %s", errors)
+
+            # Classify the errors in a single pass
+            rate_limited = False
+            timeframe_error = False
+            for error in errors:
+                if 'rate limit' in error.get('message', '').lower():
+                    rate_limited = True
+                if 'timeFrame' in (error.get('path') or ()):
+                    timeframe_error = True
+
+            # Handle rate limiting reported as GraphQL errors
+            if rate_limited:
+                logger.warning("Rate limit encountered. Sleeping for %s seconds.", RATE_LIMIT_SLEEP)
+                time.sleep(RATE_LIMIT_SLEEP)
+                retry_count += 1
+                continue
+            elif timeframe_error:
+                logger.error("Error related to 'timeFrame'. Please verify the parameter value.")
+                return False, result
+            else:
+                logger.error("Unhandled API errors: %s", [error.get('message', '') for error in errors])
+                return False, result
+
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             logger.error("Request error on attempt %d: %s", retry_count + 1, e)
             if retry_count >= MAX_RETRIES:
                 logger.critical("Max retries exceeded. Exiting.")
@@ -90,39 +152,72 @@ def send_query(query: str, api_key: str) -> Tuple[bool, Optional[Dict[str, Any]]
     return False, None
 
 
-def construct_query(account_id: str, timeframe: str, marker: str) -> str:
+def send_query_in_background(payload: bytes, session: requests.Session = SESSION) -> Future:
     """
-    Construct the GraphQL query string.
+    Run send_query on a daemon thread.
+
+    A daemon thread does not keep the script alive when the caller stops early (Ctrl-C or a
+    write error) while a prefetched request is still waiting or retrying.
+
+    Args:
+        payload (bytes): The JSON request body holding the query and its variables.
+        session (requests.Session, optional): The session to send the request with. Defaults to the shared SESSION.
+
+    Returns:
+        Future: Resolves to the send_query result, or raises what send_query raised.
+    """
+    future = Future()
+
+    def run() -> None:
+        try:
+            future.set_result(send_query(payload, session))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+def construct_payload_prefix(account_id: str, timeframe: str) -> bytes:
+    """
+    Serialize the parts of the request body that stay the same for every page.
 
     Args:
         account_id (str): The account ID for which to fetch audit logs.
         timeframe (str): The timeframe for the audit logs.
+
+    Returns:
+        bytes: The JSON request body up to, but not including, the marker value.
+    """
+    static = orjson.dumps({
+        'query': AUDIT_FEED_QUERY,
+        'variables': {'accountIDs': [account_id], 'timeFrame': timeframe}
+    })
+    # Reopen the variables object so the marker can be appended to it
+    return static[:-2] + b',"marker":'
+
+
+def construct_payload(prefix: bytes, marker: str) -> bytes:
+    """
+    Construct the JSON request body for one page of the audit feed.
+
+    Args:
+        prefix (bytes): The static part of the body from construct_payload_prefix.
         marker (str): The pagination marker.
 
     Returns:
-        str: The constructed GraphQL query.
+        bytes: The complete JSON request body.
     """
-    return '''
-{
-	auditFeed(accountIDs:[''' + account_id + '''] timeFrame:"''' + timeframe + '''" marker:"''' + marker + '''") {
-		marker
-		fetchedCount
-		hasMore
-		accounts {
-			id
-			records {
-				time
-				fieldsMap
-			}
-		}
-	}
-}'''
+    return prefix + orjson.dumps(marker) + b'}}'
 
 
+@lru_cache(maxsize=4096)
 def convert_timestamp(ms_timestamp: str) -> str:
     """
     Convert a timestamp in milliseconds to a human-readable UTC datetime string.
 
+    Results are cached, since logs from bulk changes often share the same timestamp.
+
     Args:
         ms_timestamp (str): Timestamp in milliseconds as a string.
 
@@ -143,6 +238,26 @@ def convert_timestamp(ms_timestamp: str) -> str:
         return ms_timestamp  # Return original if conversion fails
 
 
+def convert_event_timestamp(iso_timestamp: Optional[str]) -> str:
+    """
+    Convert an ISO 8601 event time to a 'YYYY-MM-DD HH:MM:SS' string.
+
+    Args:
+        iso_timestamp (Optional[str]): The event time as returned by the API, e.g. '2024-10-10T12:34:56Z'.
+
+    Returns:
+        str: The formatted datetime string, an empty string if the record has no time,
+        or the original value if it cannot be parsed.
+    """
+    if iso_timestamp is None:
+        return ''  # Record without a time; leave the cell empty
+    try:
+        return datetime.fromisoformat(iso_timestamp).strftime('%Y-%m-%d %H:%M:%S')
+    except (TypeError, ValueError) as e:
+        logger.error(f"Error converting event timestamp {iso_timestamp}: {e}")
+        return iso_timestamp  # Return original if conversion fails
+
+
 def unflatten_dict(d: Dict[str, Any], sep: str = '.') -> Dict[str, Any]:
     """
     Reconstruct nested dictionaries from flat dictionaries with dot-separated keys.
@@ -166,6 +281,27 @@ def unflatten_dict(d: Dict[str, Any], sep: str = '.') -> Dict[str, Any]:
     return result
 
 
+def extract_nested(d: Dict[str, Any], prefix: str, sep: str = '.') -> Any:
+    """
+    Reconstruct only the value found under a dot-separated key prefix.
+
+    Args:
+        d (Dict[str, Any]): The flat dictionary.
+        prefix (str): The key prefix to extract, e.g. 'change.After'.
+        sep (str): Separator used in keys.
+
+    Returns:
+        Any: The value stored directly under the prefix if there is one, otherwise the
+        reconstructed nested dictionary under the prefix, or an empty dict.
+    """
+    # A value stored under the exact prefix replaces any nested keys, as in unflatten_dict
+    if prefix in d:
+        return d[prefix]
+    prefix += sep
+    start = len(prefix)
+    return unflatten_dict({key[start:]: value for key, value in d.items() if key.startswith(prefix)}, sep)
+
+
 def generate_log_summary(log: Dict[str, Any]) -> str:
     """
     Generate a human-readable summary of a log entry.
@@ -181,57 +317,58 @@ def generate_log_summary(log: Dict[str, Any]) -> str:
     insertion_date = convert_timestamp(log.get('insertion_date', ''))
     event_timestamp = log.get('event_timestamp', '')
 
-    # Reconstruct nested fields
-    nested_log = unflatten_dict(log)
-
-    # Extract key information
-    admin = nested_log.get('admin', 'Unknown Admin')
-    admin_id = nested_log.get('admin_id', 'Unknown ID')
-    change_type = nested_log.get('change_type', 'Unknown Change Type')
-    model_type = nested_log.get('model_type', 'Unknown Model Type')
-    model_name = nested_log.get('model_name', 'Unknown Model Name')
-    module = nested_log.get('module', 'Unknown Module')
+    # Extract key information; these are top-level keys, so the flat log is read directly
+    admin = log.get('admin', 'Unknown Admin')
+    admin_id = log.get('admin_id', 'Unknown ID')
+    change_type = log.get('change_type', 'Unknown Change Type')
+    model_type = log.get('model_type', 'Unknown Model Type')
+    model_name = log.get('model_name', 'Unknown Model Name')
+    module = log.get('module', 'Unknown Module')
 
     # Start building the summary
-    summary = f"**Event Timestamp:** {event_timestamp}\n"
-    summary += f"**Admin:** {admin} (ID: {admin_id})\n"
-    summary += f"**Change Type:** {change_type}\n"
-    summary += f"**Model Type:** {model_type}\n"
-    summary += f"**Model Name:** {model_name}\n"
-    summary += f"**Module:** {module}\n"
-    summary += f"**Creation Date:** {creation_date}\n"
-    summary += f"**Insertion Date:** {insertion_date}\n"
+    parts = [
+        f"**Event Timestamp:** {event_timestamp}\n",
+        f"**Admin:** {admin} (ID: {admin_id})\n",
+        f"**Change Type:** {change_type}\n",
+        f"**Model Type:** {model_type}\n",
+        f"**Model Name:** {model_name}\n",
+        f"**Module:** {module}\n",
+        f"**Creation Date:** {creation_date}\n",
+        f"**Insertion Date:** {insertion_date}\n",
+    ]
 
     # Add details about changes
-    change_after = nested_log.get('change', {}).get('After', {})
-    change_before = nested_log.get('change', {}).get('Before', {})
+    change_after = extract_nested(log, 'change.After')
+    change_before = extract_nested(log, 'change.Before')
 
     if change_after:
-        summary += "**Changes After:**\n"
-        summary += json.dumps(change_after, indent=4) + "\n"
+        parts.append("**Changes After:**\n")
+        parts.append(orjson.dumps(change_after, option=orjson.OPT_INDENT_2).decode() + "\n")
     if change_before:
-        summary += "**Changes Before:**\n"
-        summary += json.dumps(change_before, indent=4) + "\n"
+        parts.append("**Changes Before:**\n")
+        parts.append(orjson.dumps(change_before, option=orjson.OPT_INDENT_2).decode() + "\n")
 
-    summary += "-" * 50 + "\n"
+    parts.append("-" * 50 + "\n")
 
-    return summary
+    return ''.join(parts)
 
 
-def save_logs_to_file(logs: list, output_file: str) -> None:
+def save_logs_to_file(pages: Iterable[List[Dict[str, Any]]], output_file: str) -> None:
     """
-    Save the audit logs as a human-readable text file.
+    Save the audit logs as a human-readable text file, writing each page as it arrives.
 
     Args:
-        logs (list): The list of audit log records.
+        pages (Iterable[List[Dict[str, Any]]]): The pages of audit log records.
         output_file (str): The filename to save the logs.
     """
     try:
+        log_count = 0
         with open(output_file, 'w', encoding='utf-8') as f:
-            for log in logs:
-                summary = generate_log_summary(log)
-                f.write(summary)
-        logger.info("Successfully saved %d logs to %s.", len(logs), output_file)
+            for page in pages:
+                # One write per page rather than one per log
+                f.write(''.join(generate_log_summary(log) for log in page))
+                log_count += len(page)
+        logger.info("Successfully saved %d logs to %s.", log_count, output_file)
     except IOError as e:
         logger.error("Failed to save logs to file: %s", e)
 
@@ -244,53 +381,59 @@ def save_logs_to_csv(logs: list, output_file: str) -> None:
         logs (list): The list of audit log records.
         output_file (str): The filename to save the logs.
     """
-    # Convert logs to pandas DataFrame
-    df = pd.DataFrame(logs)
-
-    # Convert timestamp fields
-    if 'creation_date' in df.columns:
-        df['creation_date'] = df['creation_date'].apply(convert_timestamp)
-    if 'insertion_date' in df.columns:
-        df['insertion_date'] = df['insertion_date'].apply(convert_timestamp)
-    if 'event_timestamp' in df.columns:
-        # Optionally, format event_timestamp
-        df['event_timestamp'] = pd.to_datetime(df['event_timestamp']).dt.strftime('%Y-%m-%d %H:%M:%S')
+    # Collect the columns in order of first appearance across all logs
+    fieldnames = list(dict.fromkeys(key for log in logs for key in log))
 
     try:
-        df.to_csv(output_file, index=False)
+        with open(output_file, 'w', encoding='utf-8', newline='') as f:
+            # Match the line endings pandas' to_csv used to write
+            writer = csv.DictWriter(f, fieldnames=fieldnames, lineterminator=os.linesep)
+            writer.writeheader()
+            for log in logs:
+                row = dict(log)
+                # Convert timestamp fields
+                for field in ('creation_date', 'insertion_date'):
+                    if field in row:
+                        row[field] = convert_timestamp(row[field])
+                if 'event_timestamp' in row:
+                    row['event_timestamp'] = convert_event_timestamp(row['event_timestamp'])
+                writer.writerow(row)
         logger.info("Successfully saved %d logs to %s.", len(logs), output_file)
     except IOError as e:
         logger.error("Failed to save logs to CSV file: %s", e)
 
 
-def fetch_audit_logs(
-        api_key: str,
+def iter_audit_log_pages(
         account_id: str,
-        timeframe: str = "P2D",
-        output_file: Optional[str] = None,
-        save_as_csv: bool = False
-) -> None:
+        timeframe: str,
+        session: requests.Session = SESSION
+) -> Iterator[List[Dict[str, Any]]]:
     """
-    Fetch audit logs from the Cato Networks API and save them to a readable file.
+    Page through the audit feed, yielding the records of each page as soon as it is fetched.
+
+    The next page is requested in the background while the caller processes the current one,
+    so the network round trip overlaps with writing the output.
 
     Args:
-        api_key (str): The API key for authentication.
         account_id (str): The account ID to fetch audit logs for.
-        timeframe (str, optional): The timeframe for the logs. Defaults to "P2D".
-        output_file (Optional[str], optional): The file to save the logs. If None, prints to console.
-        save_as_csv (bool, optional): Whether to save the logs as CSV. Defaults to False.
+        timeframe (str): The timeframe for the logs.
+        session (requests.Session, optional): The authenticated session to use. Defaults to the shared SESSION.
+
+    Yields:
+        List[Dict[str, Any]]: The fieldsMap of each record on the page, with 'event_timestamp' added.
     """
     total_count = 0
     api_call_count = 0
     iteration = 1
     marker = ""
-    all_logs = []
     start_time = datetime.now()
+    payload_prefix = construct_payload_prefix(account_id, timeframe)
+
+    # Only one request is in flight at a time, since each page needs the previous marker
+    future = send_query_in_background(construct_payload(payload_prefix, marker), session)
 
     while True:
-        query = construct_query(account_id, timeframe, marker)
-        logger.debug("Sending query: %s", query)
-        success, response = send_query(query, api_key)
+        success, response = future.result()
 
         if not success or not response:
             logger.critical("Failed to retrieve audit logs. Exiting.")
@@ -312,12 +455,18 @@ def fetch_audit_logs(
             iteration, fetched_count, total_count, has_more
         )
 
+        if has_more:
+            # Start fetching the next page before handing this one to the caller
+            future = send_query_in_background(construct_payload(payload_prefix, marker), session)
+
         records = audit_data.get("accounts", [{}])[0].get("records", [])
 
+        page = []
         for event in records:
             fields_map = event.get("fieldsMap", {})
             fields_map["event_timestamp"] = event.get("time")
-            all_logs.append(fields_map)
+            page.append(fields_map)
+        yield page
 
         if not has_more:
             break
@@ -330,16 +479,43 @@ def fetch_audit_logs(
         total_count, api_call_count, end_time - start_time
     )
 
+
+def fetch_audit_logs(
+        api_key: str,
+        account_id: str,
+        timeframe: str = "P2D",
+        output_file: Optional[str] = None,
+        save_as_csv: bool = False
+) -> None:
+    """
+    Fetch audit logs from the Cato Networks API and save them to a readable file.
+
+    Text output and console output are written page by page; CSV output needs every
+    column up front, so it is written once all pages have been fetched.
+
+    Args:
+        api_key (str): The API key for authentication.
+        account_id (str): The account ID to fetch audit logs for.
+        timeframe (str, optional): The timeframe for the logs. Defaults to "P2D".
+        output_file (Optional[str], optional): The file to save the logs. If None, prints to console.
+        save_as_csv (bool, optional): Whether to save the logs as CSV. Defaults to False.
+    """
+    # Set the API key once; every page request reuses it through the session
+    SESSION.headers['x-api-key'] = api_key
+
+    pages = iter_audit_log_pages(account_id, timeframe, SESSION)
+
     if output_file:
         if save_as_csv:
+            all_logs = [log for page in pages for log in page]
             save_logs_to_csv(all_logs, output_file)
         else:
-            save_logs_to_file(all_logs, output_file)
+            save_logs_to_file(pages, output_file)
     else:
         # Print to console if no output file is specified
-        for log_entry in all_logs:
-            summary = generate_log_summary(log_entry)
-            print(summary)
+        for page in pages:
+            # Each summary is followed by a blank line, as print() used to add
+            sys.stdout.write(''.join(generate_log_summary(log_entry) + "\n" for log_entry in page))
 
 
 def parse_arguments() -> argparse.Namespace: